@@ -0,0 +1,167 @@
+"""
+Benchmarks of the model hot paths.
+
+Run from the repository root:
+
+    python -m benchmarks.benchmark               # compare against baseline.json
+    python -m benchmarks.benchmark --save        # record a new baseline
+    python -m benchmarks.benchmark --output results.json
+
+Timings are the best time per call over several repeats. A benchmark fails
+when it is more than --tolerance times slower than its baseline, and the
+script then exits with status 1.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+import numpy as np
+
+from ltfte.ltfte import Sigmoid, MultiSigmoid, Augmented, Smart, Bonding, Corporate, BondingCurve
+from ltfte.token_emissions import TokenEmissions
+from quantitativeinvestmentanalysis.qia import InterestRate, CashFlow
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def stakeholders(n):
+    """Returns n stakeholders sharing the whole supply"""
+    rng = np.random.default_rng(0)
+    return [{
+        "name": "Stakeholder_{}".format(i),
+        "allocation": 100 / n,
+        "cliff": int(rng.integers(0, 12)),
+        "vesting": int(rng.integers(12, 48)),
+        "unlock0_amt": 0,
+    } for i in range(n)]
+
+
+def curve(model):
+    """curve() on a supply grid the cache has not seen, so f(x) is evaluated"""
+    x = np.array(model.x())
+    return lambda: model.curve(x)
+
+
+def reserves(model):
+    """reserves() with the curve cache cleared, as after a parameter change"""
+    def run():
+        model.curve_cache.clear()
+        return model.reserves()
+    return run
+
+
+def mint(CAD):
+    b = Bonding()
+
+    def run():
+        b.current_supply = 10000
+        return b.mint(CAD)
+    return run
+
+
+def update_debt_bounds():
+    c = Corporate()
+    supply = iter(range(10**9))
+
+    def run():
+        c.current_supply = 10000 + next(supply) % 1000
+        return c.update_debt_bounds()
+    return run
+
+
+def quote():
+    b = BondingCurve()
+    return lambda: b.quote(collateral=100)
+
+
+def vesting_schedule(n):
+    te = TokenEmissions(stakeholders(n))
+    return te.get_vesting_schedule
+
+
+def cash_flow():
+    return CashFlow(InterestRate(real_risk_free_interest_rate=0.05), N=100).cash_flow
+
+
+BENCHMARKS = {
+    'Sigmoid.curve': lambda: curve(Sigmoid()),
+    'MultiSigmoid.curve': lambda: curve(MultiSigmoid()),
+    'Augmented.curve': lambda: curve(Augmented()),
+    'Smart.curve': lambda: curve(Smart()),
+    'Augmented.reserves': lambda: reserves(Augmented()),
+    'Bonding.mint[small]': lambda: mint(10),
+    'Bonding.mint[large]': lambda: mint(1e6),
+    'Corporate.update_debt_bounds': update_debt_bounds,
+    'BondingCurve.quote': quote,
+    'TokenEmissions.get_vesting_schedule[5]': lambda: vesting_schedule(5),
+    'TokenEmissions.get_vesting_schedule[1000]': lambda: vesting_schedule(1000),
+    'TokenEmissions.get_vesting_schedule[50000]': lambda: vesting_schedule(50000),
+    'CashFlow.cash_flow[N=100]': cash_flow,
+}
+
+
+def run(names=None, repeat=5):
+    """Times the benchmarks and returns the best seconds per call by name"""
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        timer = timeit.Timer(setup())
+        number, _ = timer.autorange()
+        results[name] = min(timer.repeat(repeat=repeat, number=number)) / number
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Prints results against baseline and returns the names that regressed"""
+    regressions = []
+    print('{:<45}{:>14}{:>14}{:>9}'.format('benchmark', 'seconds', 'baseline', 'ratio'))
+    for name, seconds in results.items():
+        if name in baseline:
+            ratio = seconds / baseline[name]
+            flag = '  REGRESSION' if ratio > tolerance else ''
+            print('{:<45}{:>14.3e}{:>14.3e}{:>9.2f}{}'.format(name, seconds, baseline[name], ratio, flag))
+            if ratio > tolerance:
+                regressions.append(name)
+        else:
+            print('{:<45}{:>14.3e}{:>14}'.format(name, seconds, '-'))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('names', nargs='*', help='benchmarks to run, all by default')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline JSON file')
+    parser.add_argument('--save', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    parser.add_argument('--tolerance', type=float, default=2.0,
+                        help='slowdown factor over the baseline that fails a benchmark')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = run(args.names, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Saved baseline to', args.baseline)
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print('\n{} benchmark(s) regressed: {}'.format(len(regressions), ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""
+Opt-in timing, call count and allocation tracking for the model classes.
+
+Nothing is instrumented until enable() is called: it replaces the methods of
+the classes defined in the profiled modules with timing wrappers, and
+disable() puts the original methods back, so profiling costs nothing when it
+is off. Bound methods taken while profiling, such as the param watchers of
+objects created inside profile(), keep their wrappers, which then only pass
+the call through.
+
+    from ltfte import profiling
+    with profiling.profile(memory=True):
+        Corporate().view()
+    profiling.stats()                        # pandas table per method
+    profiling.write_collapsed('ltfte.folded')  # flamegraph.pl / speedscope input
+"""
+import functools
+import importlib
+import inspect
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+MODULES = ['ltfte.ltfte', 'ltfte.token_emissions', 'quantitativeinvestmentanalysis.qia']
+
+_patched = []
+_enabled = False
+_stack = []
+_track_memory = False
+_started_tracing = False
+_calls = defaultdict(int)
+_total = defaultdict(float)
+_own = defaultdict(float)
+_allocated = defaultdict(int)
+_peak = defaultdict(int)
+_stacks = defaultdict(float)
+
+
+class _Frame:
+    __slots__ = ['name', 'children', 'start_memory', 'peak']
+
+    def __init__(self, name):
+        self.name = name
+        self.children = 0.0
+        self.start_memory = 0
+        self.peak = 0
+
+
+def _enter(name):
+    frame = _Frame(name)
+    if _track_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        if _stack:
+            _stack[-1].peak = max(_stack[-1].peak, peak)
+        tracemalloc.reset_peak()
+        frame.start_memory = frame.peak = current
+    _stack.append(frame)
+    return frame
+
+
+def _exit(frame, elapsed):
+    _stack.pop()
+    name = frame.name
+    _calls[name] += 1
+    _total[name] += elapsed
+    _own[name] += elapsed - frame.children
+    _stacks[tuple(f.name for f in _stack) + (name,)] += elapsed - frame.children
+    if _stack:
+        _stack[-1].children += elapsed
+    if _track_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        frame.peak = max(frame.peak, peak)
+        _allocated[name] += current - frame.start_memory
+        _peak[name] = max(_peak[name], frame.peak - frame.start_memory)
+        if _stack:
+            _stack[-1].peak = max(_stack[-1].peak, frame.peak)
+
+
+def _timed(name, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+        frame = _enter(name)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _exit(frame, time.perf_counter() - start)
+    return wrapper
+
+
+def _methods(cls):
+    """Yields the names and raw attributes of the methods defined on cls"""
+    for name, attribute in vars(cls).items():
+        if name.startswith('__') and name != '__init__':
+            continue
+        if inspect.isfunction(attribute) or isinstance(attribute, (classmethod, staticmethod)):
+            yield name, attribute
+
+
+def enable(modules: list = None, memory: bool = False):
+    """Instruments every method of the classes defined in modules
+
+    Args:
+        modules (list, optional): module names to profile. Defaults to MODULES.
+        memory (bool, optional): also track allocations with tracemalloc.
+        Defaults to False. tracemalloc is started if it is not tracing yet and
+        stopped again by disable() only in that case. Every profiled call
+        resets the tracemalloc peak, so a peak the caller reads with
+        tracemalloc.get_traced_memory() only covers the time since the last
+        profiled call.
+    """
+    global _enabled, _track_memory, _started_tracing
+    disable()
+    _enabled = True
+    _track_memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracing = True
+    for module in modules or MODULES:
+        module = importlib.import_module(module)
+        for cls in vars(module).values():
+            if not inspect.isclass(cls) or cls.__module__ != module.__name__:
+                continue
+            for name, attribute in _methods(cls):
+                qualname = '{}.{}.{}'.format(module.__name__, cls.__name__, name)
+                if isinstance(attribute, (classmethod, staticmethod)):
+                    wrapped = type(attribute)(_timed(qualname, attribute.__func__))
+                else:
+                    wrapped = _timed(qualname, attribute)
+                setattr(cls, name, wrapped)
+                _patched.append((cls, name, attribute))
+
+
+def disable():
+    """Restores the original methods"""
+    global _enabled, _track_memory, _started_tracing
+    _enabled = False
+    while _patched:
+        cls, name, attribute = _patched.pop()
+        setattr(cls, name, attribute)
+    if _started_tracing and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _track_memory = False
+    _started_tracing = False
+
+
+def reset():
+    """Clears the recorded data"""
+    for data in [_calls, _total, _own, _allocated, _peak, _stacks]:
+        data.clear()
+
+
+@contextmanager
+def profile(modules: list = None, memory: bool = False):
+    """Profiles the enclosed block, see enable()"""
+    enable(modules, memory)
+    try:
+        yield
+    finally:
+        disable()
+
+
+def stats():
+    """Returns the recorded data per method
+
+    Returns:
+        DataFrame: calls, total (inclusive) and own seconds, mean seconds per
+        call and, with memory tracking, the net bytes allocated and the peak
+        bytes above the start of a call, sorted by own time
+    """
+    df = pd.DataFrame({
+        'calls': pd.Series(_calls, dtype=int),
+        'total_s': pd.Series(_total, dtype=float),
+        'own_s': pd.Series(_own, dtype=float),
+    })
+    df['mean_s'] = df['total_s'] / df['calls']
+    if _allocated:
+        df['allocated_bytes'] = pd.Series(_allocated)
+        df['peak_bytes'] = pd.Series(_peak)
+    df.index.name = 'method'
+    return df.sort_values('own_s', ascending=False)
+
+
+def collapsed():
+    """Returns the own time of every call stack in the collapsed stack format
+    read by flamegraph.pl and speedscope, in microseconds
+
+    Returns:
+        str: one 'outer;inner microseconds' line per call stack
+    """
+    return '\n'.join(
+        '{} {}'.format(';'.join(stack), int(round(seconds * 1e6)))
+        for stack, seconds in sorted(_stacks.items()))
+
+
+def write_collapsed(path: str):
+    """Writes collapsed() to path"""
+    with open(path, 'w') as f:
+        f.write(collapsed() + '\n')
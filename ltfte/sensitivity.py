@@ -0,0 +1,128 @@
+"""
+Sensitivity analysis over the parameter bounds of the models.
+
+Grids are built from the bounds declared on the model's parameters and
+evaluated with the class sweeps (TokenEngineering.sweep and the curves'
+sweep_reserves) in batches, so no Parameterized object is mutated per grid
+point. Parameters left out of a grid keep the values of the model passed in.
+The supply grid of a curve spans m*zoom, so the sets are swept over the grid
+of their own value of m.
+
+    from ltfte.ltfte import Corporate
+    from ltfte import sensitivity
+    sensitivity.tornado(Corporate(), 'net', ['reserve_rate', 'debt'])
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+import param as pm
+
+from ltfte.ltfte import Augmented
+
+
+def values(model, name: str, points: int = 5):
+    """Evenly spaced values of a parameter between its bounds
+
+    Args:
+        model (Parameterized): model declaring the parameter
+        name (str): parameter name
+        points (int, optional): number of values. Defaults to 5.
+
+    Returns:
+        ndarray: the values, rounded and deduplicated for Integer parameters
+    """
+    low, high = model.param[name].bounds
+    if low is None or high is None:
+        raise ValueError("Parameter {} has no bounds to build a grid over".format(name))
+    grid = np.linspace(low, high, points)
+    if isinstance(model.param[name], pm.Integer):
+        grid = np.unique(np.round(grid))
+    return grid
+
+
+def _grid(model, m):
+    """Supply grid the model would use with its m set to m"""
+    if m == model.m:
+        return model.x()
+    params = {name: getattr(model, name) for name in model._curve_params}
+    params['m'] = m
+    return type(model)(**params).x()
+
+
+def _sweep_reserves(model, params):
+    """sweep_reserves() of the model class, grouping the sets by their supply grid"""
+    reserves = [type(model).sweep_reserves(group, _grid(model, m)).set_axis(group.index)
+                for m, group in params.groupby('m', sort=False)]
+    return pd.concat(reserves).loc[params.index]
+
+
+def evaluate(model, params, batch_size: int = 1000):
+    """Outcomes of the model for a table of parameter sets
+
+    Args:
+        model (Parameterized): TokenEngineering or a curve with sweep_reserves.
+        Parameters missing from params take the model's values
+        params (DataFrame): a column per parameter and a row per set
+        batch_size (int, optional): parameter sets per sweep. Defaults to 1000.
+
+    Returns:
+        DataFrame: the outcome columns of the sweep, a row per set
+    """
+    params = pd.DataFrame(params).reset_index(drop=True)
+    base = {name: getattr(model, name) for name in type(model)._sweep_params if name not in params}
+    results = []
+    for start in range(0, max(len(params), 1), batch_size):
+        batch = params.iloc[start:start + batch_size].assign(**base)
+        if isinstance(model, Augmented):
+            results.append(_sweep_reserves(model, batch))
+        else:
+            results.append(type(model).sweep(batch))
+    return pd.concat(results, ignore_index=True)
+
+
+def one_at_a_time(model, names: list, points: int = 5, batch_size: int = 1000):
+    """Varies each parameter over its bounds with the others held at the model's values
+
+    Returns:
+        DataFrame: parameter, value and outcome columns, a row per grid point
+    """
+    grid = pd.concat([pd.DataFrame({'parameter': name, 'value': values(model, name, points)})
+                      for name in names], ignore_index=True)
+    params = pd.DataFrame({name: np.where(grid['parameter'] == name, grid['value'], getattr(model, name))
+                           for name in names})
+    return pd.concat([grid, evaluate(model, params, batch_size)], axis=1)
+
+
+def full_factorial(model, names: list, points: int = 5, batch_size: int = 1000):
+    """Evaluates every combination of the parameter values
+
+    Returns:
+        DataFrame: a column per parameter and per outcome, a row per combination
+    """
+    params = pd.DataFrame(list(itertools.product(*[values(model, name, points) for name in names])),
+                          columns=names)
+    outcomes = evaluate(model, params, batch_size).drop(columns=names, errors='ignore')
+    return pd.concat([params, outcomes], axis=1)
+
+
+def tornado(model, outcome: str, names: list, points: int = 5):
+    """Ranks parameters by how far they move an outcome over their bounds
+
+    Args:
+        model (Parameterized): model at the base values
+        outcome (str): outcome column, e.g. 'Net Profit' or 'net'
+        names (list): parameters to vary
+        points (int, optional): values per parameter. Defaults to 5.
+
+    Returns:
+        DataFrame: per parameter the outcome at the lower and upper bound, its
+        minimum and maximum over the grid and the swing between them, sorted
+        by swing
+    """
+    oat = one_at_a_time(model, names, points)
+    result = oat.groupby('parameter', sort=False)[outcome].agg(['first', 'last', 'min', 'max'])
+    result.columns = ['low', 'high', 'min', 'max']
+    result['base'] = evaluate(model, pd.DataFrame(index=[0]))[outcome].iloc[0]
+    result['swing'] = result['max'] - result['min']
+    return result.sort_values('swing', ascending=False)
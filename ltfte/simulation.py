@@ -0,0 +1,193 @@
+"""
+Replay of order streams against the Bonding and Corporate curves, and the
+batched process pool runner of the Monte Carlo simulations.
+"""
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def run_batches(function, args: list, n_paths: int, batch_size: int = 10000, processes: int = None,
+                seed: int = 0):
+    """Runs function(*args, paths, seed) over batches of paths
+
+    The paths are split into batches of at most batch_size, each drawing from
+    its own stream spawned from seed, so results do not depend on the number
+    of processes. function must be defined at module level to be sent to the
+    process pool.
+
+    Args:
+        function (callable): simulates a batch
+        args (list): arguments before the number of paths and the seed
+        n_paths (int): number of paths
+        batch_size (int, optional): paths per batch. Defaults to 10000.
+        processes (int, optional): size of the process pool, 1 runs in this
+        process. Defaults to None, the number of CPUs.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        list: the result of every batch, in order
+    """
+    batches = [min(batch_size, n_paths - start) for start in range(0, n_paths, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+    if processes == 1:
+        return [function(*args, n, s) for n, s in zip(batches, seeds)]
+    with ProcessPoolExecutor(processes) as pool:
+        return list(pool.map(function, *zip(*[list(args) + [n, s] for n, s in zip(batches, seeds)])))
+
+
+class TradeReplay:
+    """
+    Replays a stream of orders against a Bonding curve without rebuilding
+    any DataFrame per trade.
+
+    Orders are floats: a positive order is CAD spent minting tokens, a
+    negative order is a number of tokens sold back to the curve. Buys are
+    priced with the curve's cumulative mint cost and sells pay out the part
+    of the reserve backing the tokens sold, so after every trade the reserve
+    is the curve's reserve at the new supply.
+    """
+
+    columns = ['cad', 'tokens', 'price', 'supply', 'spot_price', 'reserve']
+
+    def __init__(self, bonding, chunk_size: int = 100000):
+        """Initialize class
+
+        Args:
+            bonding (Bonding): curve to trade against, its current_supply is
+            the starting supply and is updated once a replay finishes
+            chunk_size (int, optional): number of orders handled per chunk.
+            Defaults to 100000.
+        """
+        self.bonding = bonding
+        self.chunk_size = chunk_size
+        self.supply = bonding.current_supply
+        x, price, cost = bonding.mint_table()
+        self._x = x
+        self._price = price
+        self._reserve = bonding.reserves_at(x)['reserve'].to_numpy()
+
+    def reserve(self, supply):
+        """Reserve backing the collateral below supply"""
+        return np.interp(supply, self._x, self._reserve)
+
+    def spot_price(self, supply):
+        """Price of the next token minted at supply"""
+        i = np.searchsorted(self._x[1:], supply, side='right')
+        return self._price[i]
+
+    def chunks(self, orders):
+        """Splits orders into arrays of at most chunk_size orders
+
+        Args:
+            orders: array, memory mapped array (np.load(..., mmap_mode='r'))
+            or iterable yielding single orders or arrays of orders
+
+        Yields:
+            ndarray: orders of the next chunk
+        """
+        if isinstance(orders, np.ndarray):
+            for start in range(0, len(orders), self.chunk_size):
+                yield np.asarray(orders[start:start + self.chunk_size], dtype=float)
+            return
+        orders = iter(orders)
+        while True:
+            chunk = list(itertools.islice(orders, self.chunk_size))
+            if not chunk:
+                return
+            if np.ndim(chunk[0]) == 0:
+                yield np.asarray(chunk, dtype=float)
+            else:
+                for array in chunk:
+                    yield from self.chunks(np.asarray(array, dtype=float))
+
+    def _supply_path(self, orders):
+        """Supply after each order, solving every run of buys or sells at once"""
+        supply = np.empty(len(orders))
+        start = 0
+        current = self.supply
+        buys = orders > 0
+        for end in itertools.chain(np.flatnonzero(np.diff(buys)) + 1, [len(orders)]):
+            run = orders[start:end]
+            if buys[start]:
+                spent = self.bonding.mint_cost(current) + np.cumsum(run)
+                supply[start:end] = self.bonding.mint_supply(spent)
+            else:
+                supply[start:end] = np.maximum(current + np.cumsum(run), 0)
+            current = supply[end - 1]
+            start = end
+        return supply
+
+    def iter_replay(self, orders):
+        """Replays orders chunk by chunk
+
+        Args:
+            orders: orders as accepted by chunks()
+
+        Yields:
+            dict: columnar arrays for the trades of each chunk, with the CAD
+            paid in (negative when paid out), the tokens minted (negative when
+            burned), the average price of the trade, and the supply, spot
+            price and reserve after it
+        """
+        for chunk in self.chunks(orders):
+            supply = self._supply_path(chunk)
+            before = np.concatenate(([self.supply], supply[:-1]))
+            tokens = supply - before
+            reserve = self.reserve(supply)
+            cad = np.where(chunk > 0, chunk, reserve - self.reserve(before))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                price = cad / tokens
+            self.supply = supply[-1]
+            yield {
+                'cad': cad,
+                'tokens': tokens,
+                'price': price,
+                'supply': supply,
+                'spot_price': self.spot_price(supply),
+                'reserve': reserve,
+            }
+
+    def replay(self, orders):
+        """Replays orders and updates the curve's current_supply
+
+        Args:
+            orders: orders as accepted by chunks()
+
+        Returns:
+            dict: the iter_replay() columns over all trades
+        """
+        results = list(self.iter_replay(orders))
+        self.bonding.current_supply = self.supply
+        if not results:
+            return {column: np.empty(0) for column in self.columns}
+        return {column: np.concatenate([r[column] for r in results]) for column in self.columns}
+
+
+def benchmark(bonding, n_trades: int = 1000000, sell_share: float = 0.3, seed: int = 0):
+    """Replays a synthetic order stream and reports the throughput
+
+    Args:
+        bonding (Bonding): curve to trade against
+        n_trades (int, optional): number of orders. Defaults to 1000000.
+        sell_share (float, optional): share of orders that are sells. Defaults to 0.3.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        dict: number of trades, elapsed seconds and trades per second
+    """
+    rng = np.random.default_rng(seed)
+    orders = rng.exponential(0.01, n_trades)
+    sells = rng.random(n_trades) < sell_share
+    orders[sells] *= -0.5
+    start = time.perf_counter()
+    TradeReplay(bonding).replay(orders)
+    elapsed = time.perf_counter() - start
+    return {'trades': n_trades, 'seconds': elapsed, 'trades_per_second': n_trades / elapsed}
+
+
+if __name__ == '__main__':
+    from ltfte.ltfte import Bonding
+    print(benchmark(Bonding(zoom=0.05)))
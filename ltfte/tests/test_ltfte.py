@@ -1,6 +1,13 @@
+import os
+import subprocess
+import sys
+
 import pytest
 
-from tecmns.ltfte import Sigmoid, MultiSigmoid, Augmented, Smart, TokenEngineering, Bonding, Corporate
+import numpy as np
+
+from ltfte.ltfte import CurveCache, Sigmoid, MultiSigmoid, Augmented, Smart, TokenEngineering, Bonding, Corporate
+from ltfte.ltfte import BondingCurveCalculator, BondingCurveInitializer, ReserveRatio, StagedSigmoid
 
 def test_sigmoid():
     return Sigmoid()
@@ -15,4 +22,265 @@ def test_TokenEngineering():
 def test_Bonding():
     return Bonding()
 def test_Corporate():
-    return Corporate()
\ No newline at end of file
+    return Corporate()
+
+
+def test_mint_batch_matches_sequential_mints():
+    single = Bonding()
+    received = [single.mint(CAD)[0] for CAD in [10, 1000, 5000]]
+    batch = Bonding()
+    batch_received, batch_price = batch.mint_batch([10, 1000, 5000])
+    assert np.allclose(batch_received, received)
+    assert np.isclose(batch.current_supply, single.current_supply)
+    assert np.allclose(batch_price * batch_received, [10, 1000, 5000])
+
+def test_mint_large_order():
+    b = Bonding()
+    received, price = b.mint(1e6)
+    assert received > 0
+    assert np.isclose(received * price, 1e6)
+
+def test_curve_cache_shares_evaluation_until_param_changes():
+    a = Augmented()
+    y = a.y()
+    a.reserves()
+    misses = a.curve_cache.info()['misses']
+    a.reserves()
+    a.view_reserves()
+    assert a.y() is y
+    assert a.curve_cache.info()['misses'] == misses
+    a.l = 21
+    assert a.y() is not y
+    a.l = 20.8
+    assert a.y() is y
+    reserves = a.reserves()
+    misses = a.curve_cache.info()['misses']
+    a.reserve_rate = 0.3
+    assert a.x() is a.x() and a.y() is y
+    assert a.curve_cache.info()['misses'] == misses
+    assert not np.isclose(a.reserves()['reserve'], reserves['reserve'])
+
+def test_curve_cache_evicts_least_recently_used():
+    cache = CurveCache(maxsize=2)
+    cache.get('a', lambda: 1)
+    cache.get('b', lambda: 2)
+    cache.get('a', lambda: 1)
+    cache.get('c', lambda: 3)
+    assert cache.get('b', lambda: 4) == 4
+    assert cache.info() == {'hits': 1, 'misses': 4, 'size': 2, 'maxsize': 2}
+
+def test_sweep_matches_per_object_evaluation():
+    params = {'l': [18, 20.8, 25], 'k2': [5, 50, 500], 'reserve_rate': [0.1, 0.2, 0.5],
+              'current_supply': [5000, 10000, 200000]}
+    x = Augmented().x()
+    prices = Augmented.sweep(params, x)
+    reserves = Augmented.sweep_reserves(params, x)
+    assert prices.shape == (3, len(x))
+    for i in range(3):
+        a = Augmented(**{name: values[i] for name, values in params.items()})
+        assert np.allclose(prices[i], a.f(x))
+        assert np.allclose(reserves.loc[i], a.reserves())
+
+
+@pytest.mark.parametrize('cls', [Smart, Corporate])
+def test_smart_sweep_reserves_use_powered_reserve_rate(cls):
+    params = {'l': [18, 20.8, 25], 'reserve_rate': [1, 1, 0.5], 'reserve_power': [4, 2, 0],
+              'current_supply': [5000, 10000, 200000], 'debt': [0, 10, 100]}
+    if cls is Smart:
+        del params['debt']
+    x = cls().x()
+    reserves = cls.sweep_reserves(params, x)
+    for i in range(3):
+        model = cls(**{name: values[i] for name, values in params.items()})
+        model.reserve_rate = params['reserve_rate'][i]
+        assert np.allclose(reserves.loc[i], model.reserves())
+
+
+def test_reserves_at_matches_collateral_sums():
+    for model in [Augmented(), Smart(), Corporate()]:
+        supplies = [1, 5000, 10000, 250000]
+        table = model.reserves_at(np.array(supplies))
+        for supply in supplies:
+            model.current_supply = supply
+            collateral = model.collateral(model.x())
+            expected = [collateral['funding'].sum(), collateral['reserve'].sum()]
+            assert np.allclose(table.loc[supply, ['funding', 'reserve']], expected)
+            assert np.allclose(model.reserves()[['funding', 'reserve']], expected)
+
+def test_adaptive_sampling_meets_tolerance_with_fewer_points():
+    adaptive = MultiSigmoid(sampling='adaptive', tolerance=1e-3, zoom=1)
+    x, y = adaptive.x(), adaptive.y()
+    fine = np.linspace(0, adaptive.m, 1000001)
+    exact = np.sum((adaptive.f(fine)[1:] + adaptive.f(fine)[:-1]) * np.diff(fine)) / 2
+    assert abs(np.sum(y[1:] * np.diff(x)) - exact) < 1e-3 * exact
+    linear = MultiSigmoid(steps=len(x), zoom=1)
+    assert abs(np.sum(linear.y()[1:] * np.diff(linear.x())) - exact) > 1e-3 * exact
+    with pytest.raises(ValueError):
+        MultiSigmoid(sampling='adaptive', tolerance=1e-8).x()
+
+
+@pytest.mark.parametrize('cls', [Smart, Corporate])
+def test_adaptive_sampling_keeps_smart_reserve_split(cls):
+    adaptive = cls(sampling='adaptive', current_supply=300000).reserves()
+    linear = cls(steps=10000, current_supply=300000).reserves()
+    assert np.allclose(adaptive, linear, rtol=1e-3)
+
+def test_token_engineering_projection_and_runway():
+    te = TokenEngineering()
+    data = te.cummulative_data()
+    month = np.arange(te.number_months)
+    contracts = month * te.new_contracts_per_month + te.number_of_initial_contracts
+    assert np.allclose(data['Contract Revenue'], month * te.monthly_contract_size * contracts)
+    assert te.ltf_treasury()[-1] == data['Net Profit'].iloc[-1]
+
+    te.new_contracts_per_month = 0
+    flat = te.simulate_runway(initial_capital=100000, n_paths=100, processes=1)
+    monthly = te.number_of_initial_contracts * te.monthly_contract_size - te.number_employees * te.monthly_salary - te.office_expense
+    assert np.allclose(flat['treasury'][50], 100000 + month * monthly)
+    ruin = 100000 // -monthly + 1
+    assert (flat['probability_of_ruin'] == (month >= ruin)).all()
+    assert (flat['runway'] == ruin).all()
+
+    te.new_contracts_per_month = 1
+    runs = [te.simulate_runway(initial_capital=100000, n_paths=2000, batch_size=500, processes=p)
+            for p in [1, 2]]
+    assert runs[0]['treasury'].equals(runs[1]['treasury'])
+    assert np.isclose(runs[0]['treasury'][50].iloc[-1], 100000 + te.results()['Net Profit'].iloc[0], rtol=0.05)
+    assert runs[0]['probability_of_ruin'].is_monotonic_increasing
+
+def test_bonding_curve_array_returns_and_quotes():
+    b = BondingCurveCalculator(amount=100)
+    amounts = np.array([-500, 0, 100, 1e5])
+    assert b.new_supply() == 5100
+    assert np.allclose(b.new_supply(amounts), [4500, 5000, 5100, 20000])
+    supplies = np.array([5000, 8000])
+    collateral = b.sale_return(50, supply=supplies)
+    assert np.allclose(collateral[1], BondingCurveCalculator(supply=(8000, 20000)).sale_return(50))
+    assert np.allclose(b.purchase_return(collateral, supply=supplies), 50)
+
+    quote = b.quote(collateral=[100, -100, 1000])
+    assert np.allclose(quote['tokens'], b.purchase_return(np.array([100, -100, 1000])), rtol=1e-5)
+    assert np.allclose(b.quote(tokens=quote['tokens'])['collateral'], [100, -100, 1000], rtol=1e-5)
+    assert (quote['slippage'][[0, 2]] > 0).all() and quote['slippage'][1] < 0
+    outside = b.quote(collateral=[1e9, 100])
+    assert np.isnan([outside[column][0] for column in outside if column != 'collateral']).all()
+    assert outside['collateral'][0] == 1e9 and not np.isnan(outside['tokens'][1])
+    for trade in [{}, {'collateral': 100, 'tokens': 10}]:
+        with pytest.raises(ValueError):
+            b.quote(**trade)
+    b.quote(tokens=10)
+    assert b.quote_cache.info()['misses'] == 1
+    b.supply = (6000, 20000)
+    assert np.isclose(b.quote(tokens=0)['new_price'], b.get_price(6000))
+    assert b.quote_cache.info()['misses'] == 2
+
+def test_power_curve_closed_forms():
+    for model in [ReserveRatio(), BondingCurveInitializer(initial_balance=2000)]:
+        x = np.linspace(0, 20000, 200001)
+        price = model.get_price(x)
+        sampled = np.concatenate(([0], np.cumsum((price[1:] + price[:-1]) / 2 * np.diff(x))))
+        supply = np.array([10, 50, 3000, 8000])
+        balance = model.get_balance(supply)
+        assert np.allclose(balance, sampled[supply * 10], rtol=1e-3)
+        assert np.allclose(model.get_supply_for_balance(balance), supply)
+        assert np.allclose(model.get_supply_for_price(model.get_price(supply)), supply)
+        assert np.allclose(model.get_market_cap(supply), model.get_price(supply) * supply)
+    initializer = BondingCurveInitializer()
+    assert np.isclose(initializer.get_balance(initializer.initial_supply), initializer.initial_balance)
+
+def test_staged_sigmoid_matches_multisigmoid_without_overflow():
+    staged = StagedSigmoid()
+    assert np.allclose(staged.y(), MultiSigmoid().y())
+    assert np.isclose(staged.f(1e5), MultiSigmoid().f(1e5))
+    with np.errstate(over='raise', invalid='raise'):
+        steep = StagedSigmoid(components=np.array([[1000, 800, 1, 1], [1, 1, 1, 2]]))
+        assert np.allclose(steep.f(np.array([0, 1e9])), [2 / (1 + np.e), 3])
+        assert np.allclose(Sigmoid(l=100, s=1, m=1).f(np.array([-1e9, 1e9])), [0, 57300])
+    key = staged.curve_key()
+    staged.components = np.array([[1., 2, 3, 4]])
+    assert staged.curve_key() != key
+    assert staged.stages()['k'].tolist() == [4]
+    with pytest.raises(ValueError):
+        StagedSigmoid(components=np.array([1., 2, 3]))
+
+def test_multisigmoid_fit_recovers_target_schedule():
+    target = MultiSigmoid(l=15, s=9, k=40000, l4=4, s4=7, k4=1500)
+    supply = np.linspace(0, 1e7, 200)
+    price = target.f(supply)
+    model = MultiSigmoid()
+    fit = model.fit(supply, price, names=['l', 's', 'k', 'l4', 's4', 'k4'], n_starts=16)
+    assert fit['rmse'] < 1e-3 * price.max()
+    rmse = fit.pop('rmse')
+    for name, value in fit.items():
+        low, high = model.param[name].bounds
+        assert low <= value <= high
+    assert model.l == 20.8
+    model.param.update(**fit)
+    assert np.isclose(np.sqrt(np.mean((model.f(supply) - price)**2)), rmse)
+
+def test_inverse_lookups():
+    for model in [Sigmoid(), MultiSigmoid(), StagedSigmoid(), Smart()]:
+        y = model.y()
+        price = np.linspace(y[0], y[-1], 1001)
+        supply = model.supply_for_price(price)
+        assert np.allclose(model.f(supply), price, rtol=1e-10)
+        assert np.isclose(model.supply_for_price(y[500]), model.x()[500])
+        assert np.isnan(model.supply_for_price(2 * y[-1]))
+    for model in [Augmented(), Smart(), Corporate()]:
+        x = model.x()
+        for column in ['funding', 'reserve', 'net']:
+            level = model.reserves_at(x)[column].to_numpy()
+            target = np.linspace(0, level.max(), 101)
+            supply = model.supply_for_reserves(target, column)
+            assert np.allclose(np.interp(supply, x, level), target)
+        assert np.isclose(model.supply_for_funding(1000), model.supply_for_reserves(1000, 'funding'))
+
+def test_smart_running_totals_follow_supply():
+    smart = Smart()
+    x = smart.x()
+    for supply in [10000, 10050, 250000, 240000, 1, 600000]:
+        smart.current_supply = supply
+        reserves = smart.reserves()
+        assert np.allclose(reserves.values, smart.reserves_at(np.array([supply])).iloc[0].values)
+    smart.reserve_power = 2
+    assert smart._totals is None
+    assert np.allclose(smart.reserves().values, smart.reserves_at(np.array([600000])).iloc[0].values)
+
+    c = Corporate(current_supply=20000)
+    collateral = c.collateral(x).iloc[-1]
+    assert c.current_price() == collateral['price']
+    assert np.isclose(c.batch_minted(), c.current_supply - collateral['supply'])
+    assert np.isclose(c.batch_available(), collateral['minted'] - c.batch_minted())
+
+def test_corporate_debt_gating_and_repayment():
+    c = Corporate(current_supply=300000)
+    funding = c.param['debt'].bounds[1]
+    for debt in [0, funding / 3, funding * 0.9]:
+        c.debt = debt
+        x = c.x()
+        collateral = c.collateral(x)
+        rescanned = collateral['funding'].cumsum() < debt
+        assert (collateral['price'].to_numpy() == np.where(rescanned, 0, c.curve(x)['price'][:len(collateral)])).all()
+        assert (c.collateral(np.array(x))['price'] == collateral['price']).all()
+        payoff = c.debt_payoff_supply()
+        assert payoff == (x[0] if debt == 0 else collateral['supply'][~rescanned & (collateral.index > 0)].iloc[0])
+    repayment = c.debt_repayment()
+    assert repayment['repaid'] == repayment['debt'] and repayment['progress'] == 1
+    c.current_supply = 100000
+    repayment = c.debt_repayment()
+    assert repayment['outstanding'] > 0 and np.isnan(repayment['payoff_supply'])
+    assert c.current_price() == 0
+
+def test_models_import_without_plotting_stack():
+    code = """
+import sys, time
+import numpy, pandas, param
+start = time.perf_counter()
+import ltfte.ltfte, ltfte.token_emissions, ltfte.simulation
+elapsed = time.perf_counter() - start
+loaded = [m for m in ['panel', 'holoviews', 'hvplot', 'bokeh', 'plotly'] if m in sys.modules]
+assert not loaded, loaded
+assert elapsed < 0.5, elapsed
+"""
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    subprocess.run([sys.executable, '-c', code], cwd=root, check=True)
@@ -0,0 +1,47 @@
+import tracemalloc
+
+from ltfte import profiling
+from ltfte.ltfte import Augmented, Bonding, Corporate
+
+
+def test_profile_records_calls_and_restores_methods():
+    reserves = Augmented.reserves
+    profiling.reset()
+    with profiling.profile(memory=True):
+        a = Augmented()
+        a.reserves()
+        a.reserves()
+        Bonding().mint(100)
+    assert Augmented.reserves is reserves
+    stats = profiling.stats()
+    assert stats.loc['ltfte.ltfte.Augmented.reserves', 'calls'] == 2
+    assert (stats['own_s'] <= stats['total_s'] + 1e-9).all()
+    assert 'peak_bytes' in stats
+    lines = profiling.collapsed().splitlines()
+    assert 'ltfte.ltfte.Bonding.mint;ltfte.ltfte.Bonding.mint_batch' in [line.rsplit(' ', 1)[0] for line in lines]
+    profiling.reset()
+    assert profiling.stats().empty
+
+
+def test_watchers_created_while_profiling_stop_recording():
+    profiling.reset()
+    with profiling.profile():
+        a = Augmented()
+        c = Corporate()
+    profiling.reset()
+    a.l = 25
+    c.current_supply = 20000
+    assert profiling.stats().empty
+
+
+def test_memory_profiling_leaves_caller_tracing_on():
+    tracemalloc.start()
+    try:
+        with profiling.profile(memory=True):
+            Augmented().reserves()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+    with profiling.profile(memory=True):
+        assert tracemalloc.is_tracing()
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,38 @@
+import numpy as np
+
+from ltfte import sensitivity
+from ltfte.ltfte import TokenEngineering, Corporate
+
+
+def test_sweeps_match_the_models():
+    te = TokenEngineering(monthly_salary=2000)
+    grid = sensitivity.evaluate(te, {'number_employees': [3, 12]})
+    for i, employees in enumerate([3, 12]):
+        te.number_employees = employees
+        assert np.allclose(grid.iloc[i].values, te.results().iloc[0].values)
+
+    c = Corporate(current_supply=20000)
+    c.debt = c.param['debt'].bounds[1] / 2
+    grid = sensitivity.evaluate(c, {'reserve_power': [0, 2]})
+    for i, power in enumerate([0, 2]):
+        c.reserve_power = power
+        assert np.allclose(grid.iloc[i].values, c.reserves().values)
+
+    grid = sensitivity.evaluate(c, {'m': [21e6, 15e6, 21e6], 'reserve_power': [2, 2, 3]})
+    for i, (m, power) in enumerate([(21e6, 2), (15e6, 2), (21e6, 3)]):
+        model = Corporate(current_supply=20000, m=m, reserve_power=power, debt=c.debt)
+        assert np.allclose(grid.iloc[i].values, model.reserves().values)
+
+
+def test_grids_and_tornado():
+    te = TokenEngineering()
+    names = ['monthly_salary', 'number_employees', 'new_contracts_per_month']
+    oat = sensitivity.one_at_a_time(te, names, points=4)
+    assert len(oat) == 12
+    assert (oat.loc[oat['parameter'] == 'number_employees', 'value'] == [3, 6, 9, 12]).all()
+    full = sensitivity.full_factorial(te, names, points=3)
+    assert len(full) == 27
+    assert full.columns[:3].tolist() == names
+    tornado = sensitivity.tornado(te, 'Net Profit', names)
+    assert tornado.index[0] == 'new_contracts_per_month'
+    assert (tornado['base'] == te.results()['Net Profit'].iloc[0]).all()
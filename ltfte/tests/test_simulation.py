@@ -0,0 +1,29 @@
+import numpy as np
+
+from ltfte.ltfte import Bonding
+from ltfte.simulation import TradeReplay
+
+
+def test_replay_buys_match_mint_batch():
+    orders = np.array([10, 1000, 5000])
+    expected, price = Bonding(zoom=0.05).mint_batch(orders)
+    b = Bonding(zoom=0.05)
+    trades = TradeReplay(b).replay(orders)
+    assert np.allclose(trades['tokens'], expected)
+    assert np.isclose(b.current_supply, trades['supply'][-1])
+
+def test_replay_sell_returns_reserve():
+    b = Bonding(zoom=0.05)
+    start = b.current_supply
+    replay = TradeReplay(b)
+    trades = replay.replay([1000.0, -500.0])
+    assert np.isclose(trades['supply'][-1], start + trades['tokens'][0] - 500)
+    assert np.isclose(trades['cad'][1], trades['reserve'][1] - trades['reserve'][0])
+    assert trades['cad'][1] < 0
+
+def test_replay_chunks_match_single_pass():
+    orders = np.random.default_rng(0).normal(1, 2, 1000)
+    whole = TradeReplay(Bonding(zoom=0.05)).replay(orders)
+    chunked = TradeReplay(Bonding(zoom=0.05), chunk_size=64).replay(iter(orders))
+    for column in TradeReplay.columns:
+        assert np.allclose(whole[column], chunked[column], equal_nan=True)
@@ -0,0 +1,62 @@
+import pytest
+
+import numpy as np
+import pandas as pd
+
+from ltfte.token_emissions import TokenEmissions
+
+
+def test_vesting_schedule_matches_linear_emissions():
+    te = TokenEmissions()
+    df = te.get_vesting_schedule()
+    for s in te.stakeholders:
+        schedule = te.calc_emissions_linear(**s)
+        assert np.allclose(df[s["name"]][:len(schedule)], schedule)
+        assert not df[s["name"]][len(schedule):].any()
+
+def test_vesting_matrix_aggregates_by_category():
+    te = TokenEmissions()
+    rng = np.random.default_rng(0)
+    grants = 1000
+    allocation = rng.uniform(0, 0.1, grants)
+    cliff = rng.integers(0, 12, grants)
+    vesting = rng.integers(12, 48, grants)
+    unlock0_amt = np.where(rng.random(grants) < 0.2, 1000, 0)
+    category = rng.choice(["Seed", "Team", "Advisors"], grants)
+    dense = te.vesting_matrix(allocation, cliff, vesting, unlock0_amt)
+    by_category = te.vesting_matrix(allocation, cliff, vesting, unlock0_amt, category=category)
+    assert dense.shape == (vesting.max() + 1, grants)
+    assert np.isclose(dense.to_numpy().sum(), te.total_token_supply * allocation.sum() * 0.01)
+    expected = dense.T.groupby(pd.Series(category)).sum().T
+    pd.testing.assert_frame_equal(by_category[expected.columns], expected, check_names=False)
+
+def test_incremental_stakeholder_changes_match_full_recompute():
+    te = TokenEmissions()
+    te.get_vesting_schedule()
+    te.add_stakeholder({"name": "Advisors", "allocation": 2, "cliff": 3, "vesting": 60, "unlock0_amt": 0})
+    te.update_stakeholder("Team", allocation=10, vesting=12)
+    te.remove_stakeholder("Community")
+    fresh = TokenEmissions(te.stakeholders)
+    expected = fresh.get_vesting_schedule()
+    pd.testing.assert_frame_equal(te._df_vesting_schedule, expected, check_dtype=False)
+    pd.testing.assert_frame_equal(te.supply_analysis(), fresh.supply_analysis())
+    with pytest.raises(ValueError):
+        te.add_stakeholder({"name": "Team", "allocation": 1, "cliff": 0, "vesting": 12, "unlock0_amt": 0})
+    with pytest.raises(KeyError):
+        te.update_stakeholder("Nobody", allocation=1)
+    with pytest.raises(KeyError):
+        te.remove_stakeholder("Nobody")
+    pd.testing.assert_frame_equal(te.supply_analysis(), fresh.supply_analysis())
+
+def test_sell_pressure_simulation_is_reproducible_and_bounded():
+    te = TokenEmissions()
+    sell = {"Team": (1, 9), "Community": (2, 5)}
+    local = te.simulate_sell_pressure(sell, n_paths=2000, batch_size=500, processes=1, seed=7)
+    pooled = te.simulate_sell_pressure(sell, n_paths=2000, batch_size=500, processes=2, seed=7)
+    pd.testing.assert_frame_equal(local["circulating_supply"], pooled["circulating_supply"])
+    with pytest.raises(KeyError):
+        te.simulate_sell_pressure({"Team": (1, 9), "Teem": (2, 5)}, n_paths=10, processes=1)
+    bands = local["circulating_supply"]
+    assert (bands.diff(axis=1).iloc[:, 1:] >= 0).all().all()
+    unlocked = te.get_vesting_schedule()[["Team", "Community"]].sum(axis=1).cumsum()
+    assert (bands[95] <= unlocked + 1e-6).all()
@@ -1,7 +1,36 @@
-import copy
 import pandas as pd
 import numpy as np
-import plotly.express as px
+
+from ltfte.simulation import run_batches
+
+
+def _simulate_sales(emissions, alpha, beta, n_paths, seed):
+    """Simulates the tokens sold each month on a batch of paths
+
+    Every month each category unlocks its emissions into its holdings and
+    sells a Beta(alpha, beta) distributed fraction of what it holds.
+
+    Args:
+        emissions (ndarray): months x categories tokens unlocked by the
+        categories that sell
+        alpha (ndarray): Beta alpha of the monthly sell fraction per category
+        beta (ndarray): Beta beta of the monthly sell fraction per category
+        n_paths (int): number of paths
+        seed (SeedSequence): seed of the batch's random stream
+
+    Returns:
+        ndarray: paths x months tokens sold
+    """
+    rng = np.random.default_rng(seed)
+    months, categories = emissions.shape
+    held = np.zeros((n_paths, categories))
+    sold = np.empty((n_paths, months))
+    for month in range(months):
+        held += emissions[month]
+        sales = held * rng.beta(alpha, beta, size=(n_paths, categories))
+        held -= sales
+        sold[:, month] = sales.sum(axis=1)
+    return sold
 
 class TokenEmissions:
     """
@@ -53,8 +82,11 @@ class TokenEmissions:
             total_token_supply (int, optional): total token supply. Defaults to 1000000000.
         """        
         self.total_token_supply = total_token_supply
-        self.stakeholders = stakeholders
+        self.stakeholders = list(stakeholders)
         self._df_vesting_schedule = None
+        self._df_cumulative = None
+        self._emissions = None
+        self._circulating = None
     
     def calc_emissions_linear(
             self,
@@ -101,6 +133,69 @@ class TokenEmissions:
                 vesting_schedule.append(monthly_unlock)
             return vesting_schedule
 
+    def vesting_matrix(
+            self,
+            allocation,
+            cliff,
+            vesting,
+            unlock0_amt,
+            category=None):
+        """Returns the vesting schedules of many grants in one vectorized pass
+        The schedules are the ones of calc_emissions_linear. A grant with no
+        vesting period unlocks all its tokens at month 0.
+
+        Each schedule is a lump at month 0 or at the cliff plus a constant
+        monthly unlock over a range of months, so the matrix is built from
+        difference arrays and never loops over grants.
+
+        Args:
+            allocation (array): grant allocation percents
+            cliff (array): number of months to pause emissions from month 0
+            vesting (array): total number of months to vest
+            unlock0_amt (array): amount of tokens to be unlocked at launch
+            category (array, optional): label of each grant. When given the
+            grants are summed by category, so memory is bounded by months x
+            categories instead of months x grants. Defaults to None.
+
+        Returns:
+            DataFrame: DataFrame with grants (or categories) as columns and
+            months as rows
+        """
+        tokens = self.total_token_supply * np.asarray(allocation, dtype=float) * 0.01
+        cliff = np.asarray(cliff, dtype=int)
+        vesting = np.asarray(vesting, dtype=int)
+        unlock0_amt = np.asarray(unlock0_amt, dtype=float)
+        if category is None:
+            columns = np.arange(len(tokens))
+            column = columns
+        else:
+            column, columns = pd.factorize(np.asarray(category))
+        months = int(vesting.max(initial=0)) + 1
+        width = len(columns)
+
+        vests = vesting > 0
+        unlocked = unlock0_amt != 0
+        periods = np.where(vests, vesting, 1)
+        rate = np.where(unlocked, tokens - unlock0_amt, tokens) / periods * vests
+        lump_month = np.where(unlocked | ~vests, 0, np.minimum(cliff, vesting))
+        lump = np.where(
+            vests,
+            np.where(unlocked, unlock0_amt, rate * cliff * (cliff <= vesting)),
+            tokens)
+        start = np.where(unlocked, 1, cliff + 1)
+        rate = rate * (start <= vesting)
+
+        steps = np.bincount(
+            np.concatenate((np.minimum(start, months) * width + column,
+                            (vesting + 1) * width + column)),
+            weights=np.concatenate((rate, -rate)),
+            minlength=(months + 1) * width)
+        schedule = np.cumsum(steps.reshape(months + 1, width)[:months], axis=0)
+        schedule += np.bincount(
+            lump_month * width + column, weights=lump,
+            minlength=months * width).reshape(months, width)
+        return pd.DataFrame(schedule, columns=columns)
+
     def get_vesting_schedule(self):
         """
         Returns a dataframe of vesting schedule containing all stakeholders.
@@ -108,21 +203,117 @@ class TokenEmissions:
         Returns:
             DataFrame: DataFrame with stakeholders as columns and months as rows
         """
-        df_columns = []
-        vesting_schedule = []
-        for i in self.stakeholders:
-            df_columns.append(i["name"])
-            vesting_schedule.append(
-                self.calc_emissions_linear(**i)
-                )
-        # generate a list of lists to dataframe
-        df = pd.DataFrame(vesting_schedule)
-        df = df.replace(np.nan, 0)
-        df = df.T
-        df.columns = df_columns
+        df = self.vesting_matrix(
+            *([s[key] for s in self.stakeholders]
+              for key in ["allocation", "cliff", "vesting", "unlock0_amt"]))
+        df.columns = [s["name"] for s in self.stakeholders]
         self._df_vesting_schedule = df
+        self._df_cumulative = df.cumsum()
+        self._emissions = df.sum(axis=1)
+        self._circulating = self._emissions.cumsum()
         return df
 
+    def _stakeholder_schedule(self, stakeholder: dict):
+        """Returns one stakeholder's schedule padded to the schedule length,
+        extending the cached schedule first if the stakeholder vests longer
+        """
+        if self._df_vesting_schedule is None:
+            self.get_vesting_schedule()
+        column = self.vesting_matrix(
+            *([stakeholder[key]] for key in ["allocation", "cliff", "vesting", "unlock0_amt"])
+            )[0].to_numpy()
+        months = len(self._df_vesting_schedule)
+        if len(column) > months:
+            index = pd.RangeIndex(len(column))
+            self._df_vesting_schedule = self._df_vesting_schedule.reindex(index, fill_value=0)
+            self._df_cumulative = self._df_cumulative.reindex(index).ffill()
+            self._emissions = self._emissions.reindex(index, fill_value=0)
+            self._circulating = self._circulating.reindex(index).ffill()
+        return np.pad(column, (0, len(self._df_vesting_schedule) - len(column)))
+
+    def _patch_supply(self, change):
+        """Applies a change in monthly emissions to the cached supply series"""
+        self._emissions += change
+        self._circulating += np.cumsum(change)
+
+    def _stakeholder_index(self, name: str):
+        """Returns the position of the stakeholder called name in stakeholders"""
+        for i, stakeholder in enumerate(self.stakeholders):
+            if stakeholder["name"] == name:
+                return i
+        raise KeyError("No stakeholder named {}".format(name))
+
+    def add_stakeholder(self, stakeholder: dict):
+        """Adds a stakeholder and patches the cached vesting schedule and
+        supply series with its column only
+
+        Args:
+            stakeholder (dict): stakeholder info, refer method calc_emissions_linear
+
+        Raises:
+            ValueError: a stakeholder with the same name already exists
+        """
+        if any(s["name"] == stakeholder["name"] for s in self.stakeholders):
+            raise ValueError("Stakeholder {} already exists".format(stakeholder["name"]))
+        column = self._stakeholder_schedule(stakeholder)
+        self._df_vesting_schedule[stakeholder["name"]] = column
+        self._df_cumulative[stakeholder["name"]] = np.cumsum(column)
+        self._patch_supply(column)
+        self.stakeholders.append(stakeholder)
+
+    def remove_stakeholder(self, name: str):
+        """Removes a stakeholder and subtracts its column from the cached
+        supply series. The schedule keeps its number of months.
+
+        Args:
+            name (str): name of stakeholder
+
+        Raises:
+            KeyError: no stakeholder has this name
+        """
+        self._stakeholder_index(name)
+        if self._df_vesting_schedule is None:
+            self.get_vesting_schedule()
+        column = self._df_vesting_schedule.pop(name).to_numpy()
+        self._df_cumulative.pop(name)
+        self._patch_supply(-column)
+        self.stakeholders = [s for s in self.stakeholders if s["name"] != name]
+
+    def update_stakeholder(self, name: str, **changes):
+        """Updates a stakeholder's allocation, cliff, vesting or unlock0_amt
+        and patches the cached schedule and supply series in place
+
+        Args:
+            name (str): name of stakeholder
+            changes: new values of the stakeholder info
+
+        Raises:
+            KeyError: no stakeholder has this name
+        """
+        i = self._stakeholder_index(name)
+        stakeholder = dict(self.stakeholders[i], **changes)
+        column = self._stakeholder_schedule(stakeholder)
+        self._patch_supply(column - self._df_vesting_schedule[name].to_numpy())
+        self._df_vesting_schedule[name] = column
+        self._df_cumulative[name] = np.cumsum(column)
+        self.stakeholders[i] = stakeholder
+
+    def supply_analysis(self):
+        """
+        Returns the circulating supply and inflation by month
+
+        Returns:
+            DataFrame: cumulative supply (inflation), monthly emissions
+            (inflation_abs) and their relative change (inflation_pct)
+        """
+        if self._df_vesting_schedule is None:
+            self.get_vesting_schedule()
+        df = pd.DataFrame({
+            'inflation': self._circulating,
+            'inflation_abs': self._emissions,
+            'inflation_pct': self._circulating.pct_change() * 100})
+        return df.replace(np.nan, 0)
+
     def plot_vesting_schedule(self):
         """
         Returns a plot of the vesting schedule
@@ -130,12 +321,10 @@ class TokenEmissions:
         Returns:
             fig: plotly fig object
         """        
-        df = copy.deepcopy(self._df_vesting_schedule)
-        # display(df)
-        df['Circulating Supply'] = df.sum(axis=1)
-        df = df.cumsum()
-        df.insert(0, "Month", df.index, True)
-        fig = px.bar(df.drop(columns=['Month', 'Circulating Supply']),
+        if self._df_cumulative is None:
+            self.get_vesting_schedule()
+        import plotly.express as px
+        fig = px.bar(self._df_cumulative,
                      labels={"index": "Months",
                              "variable": "Category",
                              "value": "Number of Tokens"},
@@ -149,15 +338,8 @@ class TokenEmissions:
         Returns:
             fig: plotly fig object
         """        
-        df = copy.deepcopy(self._df_vesting_schedule)
-        df['Circulating Supply'] = df.sum(axis=1)
-        inflation_abs = df['Circulating Supply']
-        inflation = inflation_abs.cumsum()
-        inflation_percent = inflation.pct_change() * 100
-        df = pd.DataFrame([inflation, inflation_abs, inflation_percent])
-        df = df.T
-        df = df.replace(np.nan, 0)
-        df.columns = ['inflation', 'inflation_abs', 'inflation_pct']
+        import plotly.express as px
+        df = self.supply_analysis()
         fig = px.line(df['inflation_pct'],
                       labels={"index": "Months",
                               "value": "Inflation %"},
@@ -171,6 +353,7 @@ class TokenEmissions:
         Returns:
             fig: plotly figure object
         """
+        import plotly.express as px
         names = [s["name"] for s in self.stakeholders]
         allocations = [s["allocation"] for s in self.stakeholders]
         fig = px.pie(values=allocations, names=names)
@@ -188,3 +371,54 @@ class TokenEmissions:
             self.plot_token_allocation(),
             self.plot_supply_analysis()
             ]
+
+    def simulate_sell_pressure(
+            self,
+            sell_distributions: dict,
+            n_paths: int = 100000,
+            percentiles: tuple = (5, 25, 50, 75, 95),
+            batch_size: int = 10000,
+            processes: int = None,
+            seed: int = 0):
+        """Monte Carlo simulation of the sell pressure from unlocked tokens
+
+        Each month every stakeholder sells a random fraction of the unlocked
+        tokens it still holds. Paths are simulated in batches spread over a
+        process pool. Every batch draws from its own stream spawned from seed,
+        so results do not depend on the number of processes.
+
+        Args:
+            sell_distributions (dict): stakeholder name to the (alpha, beta)
+            of the Beta distribution of its monthly sell fraction. Stakeholders
+            not listed hold all their tokens
+            n_paths (int, optional): number of paths. Defaults to 100000.
+            percentiles (tuple, optional): percentile bands to return.
+            Defaults to (5, 25, 50, 75, 95).
+            batch_size (int, optional): paths per batch. Defaults to 10000.
+            processes (int, optional): size of the process pool, 1 runs in this
+            process. Defaults to None, the number of CPUs.
+            seed (int, optional): random seed. Defaults to 0.
+
+        Returns:
+            dict: DataFrames of months x percentiles for 'sell_pressure', the
+            tokens sold each month, and 'circulating_supply', the tokens sold
+            onto the market so far
+
+        Raises:
+            KeyError: a name in sell_distributions is not a stakeholder
+        """
+        emissions = self.get_vesting_schedule()
+        unknown = set(sell_distributions) - set(emissions.columns)
+        if unknown:
+            raise KeyError("No stakeholders named {}".format(sorted(unknown)))
+        sellers = [name for name in emissions.columns if name in sell_distributions]
+        alpha, beta = np.array([sell_distributions[name] for name in sellers], dtype=float).reshape(-1, 2).T
+        percentiles = list(percentiles)
+        sold = np.concatenate(run_batches(
+            _simulate_sales, [emissions[sellers].to_numpy(), alpha, beta], n_paths, batch_size, processes, seed))
+        return {
+            'sell_pressure': pd.DataFrame(
+                np.percentile(sold, percentiles, axis=0).T, columns=percentiles),
+            'circulating_supply': pd.DataFrame(
+                np.percentile(np.cumsum(sold, axis=1), percentiles, axis=0).T, columns=percentiles),
+        }
@@ -2,11 +2,8 @@
 This module is an implementation of the book Quantitative Investment Analysis, DeFusco, McLeavey, Pinto, Runkle, Second Edition, CFA Institute Investment Series, Wiley Publishing.
 You can find the 3rd edition of this book available here: https://www.wiley.com/en-gb/Quantitative+Investment+Analysis%2C+3rd+Edition-p-9781119104599
 """
-import panel as pn
 import pandas as pd
 import numpy as np
-import hvplot.pandas
-import holoviews as hv
 import param as pm
 import random
 import math
@@ -70,6 +67,180 @@ class InterestRate(pm.Parameterized):
         return self.nominal_risk_free_interest_rate() + self.default_risk_premium + self.liquidity_premium + self.maturity_premium
 
 
+class YieldCurve(InterestRate):
+    """
+    The term structure of interest rates gives a different rate for each
+    maturity. The spot rate of a maturity is either read off rates, or is the
+    interest rate of the premia above with the maturity premium replaced by
+    the premium of that maturity in maturity_premia. Spot rates between the
+    given maturities are interpolated linearly and held flat beyond them.
+
+    Discount factors (1 + r(t))**-t of whole periods are computed once per
+    version of the curve and shared by every CashFlow and NetPresentValue
+    priced against it. Cash flows that compound m times a period discount
+    with (1 + r(t)/m)**(-m*t) instead, or exp(-r(t)*t) for continuous
+    compounding (m = np.inf), each cached separately. Assign new lists to maturities, rates or
+    maturity_premia rather than changing them in place, so the cached
+    factors are invalidated.
+    """
+    maturities = pm.List(
+        [1], item_type=(int, float), precedence=1,
+        doc="""Maturities, in periods, of the rates or maturity premia.""")
+
+    rates = pm.List(
+        [], item_type=(int, float), precedence=1,
+        doc="""Spot rate of each maturity. Leave empty to build the spot rates
+        from the premia.""")
+
+    maturity_premia = pm.List(
+        [0], item_type=(int, float), precedence=1,
+        doc="""Maturity premium of each maturity, used when rates is empty.""")
+
+    def __init__(self, **params):
+        super(YieldCurve, self).__init__(**params)
+        self.version = 0
+        self._factors = {}
+        self.param.watch(self._invalidate, [name for name in self.param if name != 'name'])
+
+    def _invalidate(self, *events):
+        self.version += 1
+        self._factors = {}
+
+    def spot_rate(self, t):
+        """Spot rate of maturity t, a number or an array of periods"""
+        if self.rates:
+            rates = self.rates
+        else:
+            rates = np.asarray(self.maturity_premia, dtype=float) + self.interest_rate() - self.maturity_premium
+        if len(rates) != len(self.maturities):
+            raise ValueError('YieldCurve needs one rate or maturity premium per maturity')
+        order = np.argsort(self.maturities)
+        return np.interp(t, np.asarray(self.maturities, dtype=float)[order], np.asarray(rates, dtype=float)[order])
+
+    def discount_factor(self, t, compound_periods=1):
+        """
+        Present value of 1 received at t, for any t, without caching, with the
+        spot rate compounded compound_periods times a period (np.inf for
+        continuous compounding)
+        """
+        rate = self.spot_rate(t)
+        if np.isinf(compound_periods):
+            return np.exp(-rate * np.asarray(t))
+        return (1 + rate / compound_periods)**np.negative(np.multiply(t, compound_periods))
+
+    def _cached_factors(self, N, compound_periods):
+        """The cached factors of compound_periods, grown to cover periods 0 to N by at least doubling them"""
+        discount_factors, annuity_factors = self._factors.get(compound_periods, (np.ones(1), np.zeros(1)))
+        if N >= len(discount_factors):
+            t = np.arange(max(N, 2 * (len(discount_factors) - 1)) + 1)
+            discount_factors = self.discount_factor(t, compound_periods)
+            annuity_factors = np.concatenate(([0], np.cumsum(discount_factors[1:])))
+            discount_factors.flags.writeable = False
+            annuity_factors.flags.writeable = False
+            self._factors[compound_periods] = discount_factors, annuity_factors
+        return discount_factors, annuity_factors
+
+    def discount_factors(self, N, compound_periods=1):
+        """
+        Discount factors of periods 0 to N, read-only and cached until the
+        curve changes.
+        """
+        return self._cached_factors(N, compound_periods)[0][:N + 1]
+
+    def annuity_factors(self, N, compound_periods=1):
+        """
+        Present value of 1 received at the end of each period up to t, for t
+        from 0 to N, cached with the discount factors.
+        """
+        return self._cached_factors(N, compound_periods)[1][:N + 1]
+
+
+class StochasticInterestRate(InterestRate):
+    """
+    A short rate that moves randomly over time instead of staying at the
+    interest rate of the premia above, which becomes the starting rate of
+    every path. The Vasicek model mean reverts to the long term rate with
+    normal shocks and can go negative. The CIR model scales the shocks by the
+    square root of the rate, so rates stay positive. Both are sampled from
+    their exact transition distributions, so the time step can be as long as
+    a whole period.
+    """
+    model = pm.ObjectSelector(
+        'vasicek', objects=['vasicek', 'cir'], precedence=1,
+        doc="""Short rate model.""")
+
+    mean_reversion = pm.Number(
+        0.5, bounds=(0, None), step=0.05, precedence=1,
+        doc="""Speed at which the rate is pulled back to the long term rate, per period.""")
+
+    long_term_rate = pm.Number(
+        None, allow_None=True, step=0.01, precedence=1,
+        doc="""Rate the short rate reverts to. Defaults to the starting rate.""")
+
+    volatility = pm.Number(
+        0.01, bounds=(0, None), step=0.005, precedence=1,
+        doc="""Volatility of the short rate, per square root period.""")
+
+    # Paths drawn from each random stream of iter_paths()
+    _path_block = 10000
+
+    def _long_term_rate(self):
+        if self.long_term_rate is None:
+            return self.interest_rate()
+        return self.long_term_rate
+
+    def _step(self, rate, dt, rng):
+        """Rates one time step dt after rate"""
+        k, theta, sigma = self.mean_reversion, self._long_term_rate(), self.volatility
+        decay = math.exp(-k * dt)
+        if self.model == 'vasicek':
+            if k == 0:
+                return rate + sigma * math.sqrt(dt) * rng.standard_normal(rate.shape)
+            deviation = sigma * math.sqrt((1 - decay**2) / (2 * k))
+            return theta + (rate - theta) * decay + deviation * rng.standard_normal(rate.shape)
+        if k == 0 or sigma == 0:
+            raise ValueError('The CIR model needs a positive mean reversion and volatility')
+        scale = sigma**2 * (1 - decay) / (4 * k)
+        df = 4 * k * theta / sigma**2
+        return scale * rng.noncentral_chisquare(df, np.maximum(rate, 0) * decay / scale)
+
+    def paths(self, n_paths: int, N: int, dt: float = 1, seed=None):
+        """
+        Simulates n_paths short rate paths of N time steps of dt periods.
+
+        Returns an array of n_paths x N + 1 rates, starting at interest_rate().
+        """
+        rng = np.random.default_rng(seed)
+        rates = np.empty((n_paths, N + 1))
+        rates[:, 0] = self.interest_rate()
+        for t in range(N):
+            rates[:, t + 1] = self._step(rates[:, t], dt, rng)
+        return rates
+
+    def iter_paths(self, n_paths: int, N: int, dt: float = 1, chunk_size: int = 100000, seed: int = 0):
+        """
+        Yields the paths() of n_paths in arrays of at most chunk_size paths.
+        The paths are drawn in blocks of _path_block paths, each from its own
+        stream spawned from seed, and the chunks are cut out of the blocks, so
+        the paths do not depend on chunk_size. At most one block is held
+        besides the chunk being filled.
+        """
+        blocks = [min(self._path_block, n_paths - start) for start in range(0, n_paths, self._path_block)]
+        chunk, filled = [], 0
+        for n, block_seed in zip(blocks, np.random.SeedSequence(seed).spawn(len(blocks))):
+            block = self.paths(n, N, dt, block_seed)
+            while len(block):
+                take = min(chunk_size - filled, len(block))
+                chunk.append(block[:take])
+                filled += take
+                block = block[take:]
+                if filled == chunk_size:
+                    yield np.concatenate(chunk)
+                    chunk, filled = [], 0
+        if chunk:
+            yield np.concatenate(chunk)
+
+
 class CashFlow(pm.Parameterized):
     """
     The time value associated with a single cash flow or lump-sum investment. The difference between an initial investment or present value (PV), which earns a rate of return (the interest rate per period) denoted as r, and its future value(FV), which will be received N years or periods from today.
@@ -94,18 +265,40 @@ class CashFlow(pm.Parameterized):
         self.interest_rate = interest_rate
         super(CashFlow, self).__init__(**params)
 
+    def term_structure(self):
+        """Is the interest rate a YieldCurve rather than a single rate?"""
+        return isinstance(self.interest_rate, YieldCurve)
+
+    def _compounding(self):
+        """Compounding periods per period applied to the spot rates of a YieldCurve"""
+        return 1
+
+    def _discount_factors(self, N):
+        return self.interest_rate.discount_factors(N, self._compounding())
+
+    def _annuity_factors(self, N):
+        return self.interest_rate.annuity_factors(N, self._compounding())
+
     def effective_rate(self):
+        if self.term_structure():
+            return self._effective_rates(self.interest_rate.spot_rate(self.N), self._compounding())
         return self.interest_rate.interest_rate()
 
     def _future_lump_value(self, t):
+        if self.term_structure():
+            return self.present_value / self._discount_factors(np.max(t))[t]
         return self.present_value * (1 + self.interest_rate.interest_rate())**t
 
     def future_lump_value(self):
         return self._future_lump_value(self.N)
 
     def _future_annuity_value(self, t):
-        value = self.annuity * ((1 + self.effective_rate())
-                                ** t - 1) / self.effective_rate()
+        if self.term_structure():
+            N = np.max(t)
+            value = self.annuity * self._annuity_factors(N)[t] / self._discount_factors(N)[t]
+        else:
+            value = self.annuity * ((1 + self.effective_rate())
+                                    ** t - 1) / self.effective_rate()
         if self.perpetuity:
             value += self.perpetuity_value()
         return value
@@ -114,12 +307,16 @@ class CashFlow(pm.Parameterized):
         return self._future_annuity_value(self.N)
 
     def _present_value_factor(self, t):
+        if self.term_structure():
+            return self._discount_factors(np.max(t))[t]
         return (1 + self.effective_rate())**(-t)
 
     def present_value_factor(self):
         return self._present_value_factor(self.N)
 
     def _present_annuity_value(self, t):
+        if self.term_structure():
+            return self.annuity * self._annuity_factors(np.max(t))[t]
         return self.annuity * ((1 - 1/(1+self.effective_rate())**t)/self.effective_rate())
 
     def present_annuity_value(self):
@@ -141,25 +338,108 @@ class CashFlow(pm.Parameterized):
         return self.present_value + self.present_annuity_value()
 
     def cash_flow(self):
-        cash_flow = pd.DataFrame([{
+        t = np.arange(self.N+1)
+        lump_value = self._future_lump_value(t)
+        annuity_value = self._future_annuity_value(t)
+        cash_flow = pd.DataFrame({
             'Time Period': t,
-            'Lump Value': self._future_lump_value(t),
-            'Annuity Value': self._future_annuity_value(t),
-            'Total Value': self._total_future_value(t),
-        } for t in range(self.N+1)])
+            'Lump Value': lump_value,
+            'Annuity Value': annuity_value,
+            'Total Value': lump_value + annuity_value,
+        })
         cash_flow['Cash Flow'] = cash_flow['Total Value'].diff().fillna(0)
         return cash_flow
 
+    @staticmethod
+    def _effective_rates(rate, compound_periods):
+        return rate
+
+    @staticmethod
+    def _future_lump_values(present_value, rate, N, compound_periods):
+        return present_value * (1 + rate)**N
+
+    @classmethod
+    def batch_valuation(cls, rate, present_value=None, annuity=None, N=None,
+                        perpetuity=None, compound_periods=1):
+        """
+        Values a whole book of instruments in one call. Every argument is a
+        number or an array, broadcast against each other, and arguments left
+        out take the parameter defaults. rate is the interest rate of each
+        instrument, as returned by InterestRate.interest_rate().
+
+        Returns a DataFrame with a row per instrument and a column per
+        valuation method, equal to what the methods of one instance give.
+        """
+        defaults = {name: cls.param[name].default for name in ['present_value', 'annuity', 'N', 'perpetuity']}
+        present_value, annuity, N, perpetuity, rate, compound_periods = np.broadcast_arrays(
+            *[defaults[name] if value is None else value for name, value in [
+                ('present_value', present_value), ('annuity', annuity), ('N', N),
+                ('perpetuity', perpetuity)]],
+            rate, compound_periods)
+        perpetuity = perpetuity.astype(bool)
+        effective_rate = cls._effective_rates(rate, compound_periods)
+        growth = (1 + effective_rate)**N
+        perpetuity_value = annuity / effective_rate
+        future_annuity_value = annuity * (growth - 1) / effective_rate + np.where(perpetuity, perpetuity_value, 0)
+        present_annuity_value = np.where(perpetuity, perpetuity_value, annuity * (1 - 1/growth) / effective_rate)
+        return pd.DataFrame({
+            'effective_rate': effective_rate,
+            'present_value_factor': (1 + effective_rate)**(-N),
+            'future_lump_value': cls._future_lump_values(present_value, rate, N, compound_periods),
+            'future_annuity_value': future_annuity_value,
+            'present_annuity_value': present_annuity_value,
+            'total_future_value': present_value * (1 + rate)**N + future_annuity_value,
+            'total_present_value': present_value + present_annuity_value,
+        })
+
+    def simulate(self, n_paths: int = 10000, chunk_size: int = 100000, seed: int = 0):
+        """
+        Values the cash flow on n_paths short rate paths of a
+        StochasticInterestRate, where the rate of each period is the short
+        rate at its start. Paths are valued chunk_size at a time to bound the
+        memory held, and the valuations do not depend on chunk_size, see
+        StochasticInterestRate.iter_paths().
+
+        Returns a DataFrame with a row per path and the future and present
+        values of the lump sum and the annuity.
+        """
+        if not isinstance(self.interest_rate, StochasticInterestRate):
+            raise TypeError('simulate() needs a StochasticInterestRate')
+        compound_periods = self._compounding()
+        results = []
+        for rates in self.interest_rate.iter_paths(n_paths, self.N, chunk_size=chunk_size, seed=seed):
+            effective_rate = self._effective_rates(rates, compound_periods)
+            growth = np.cumprod(1 + effective_rate[:, :self.N], axis=1)
+            total_growth = growth[:, -1] if self.N else np.ones(len(rates))
+            present_annuity_value = self.annuity * (1 / growth).sum(axis=1)
+            future_annuity_value = present_annuity_value * total_growth
+            if self.perpetuity:
+                perpetuity_value = self.annuity / effective_rate[:, -1]
+                future_annuity_value = future_annuity_value + perpetuity_value
+                present_annuity_value = present_annuity_value + perpetuity_value / total_growth
+            future_lump_value = self.present_value * total_growth
+            results.append(pd.DataFrame({
+                'future_lump_value': future_lump_value,
+                'future_annuity_value': future_annuity_value,
+                'present_annuity_value': present_annuity_value,
+                'total_future_value': future_lump_value + future_annuity_value,
+                'total_present_value': self.present_value + present_annuity_value,
+            }))
+        return pd.concat(results, ignore_index=True)
+
     def view_cash_flow(self):
+        import hvplot.pandas
         cash_flow = self.cash_flow()
         return cash_flow.hvplot.table()
 
     def view_cash_flow_chart(self):
+        import hvplot.pandas
         cash_flow = self.cash_flow()
         return cash_flow.hvplot.line(x='Time Period', title="Cash Flow")
 
     @pm.depends('interest_rate.param')
     def view(self):
+        import panel as pn
         return pn.Row(pn.Column(
             "Effective Rate",
             self.effective_rate(),
@@ -190,21 +470,51 @@ class CompoundingCashFlow(CashFlow):
     def total_compound_periods(self):
         return self.N * self.compound_periods
 
+    def _compounding(self):
+        return self.compound_periods
+
     def effective_rate(self):
+        if self.term_structure():
+            return super(CompoundingCashFlow, self).effective_rate()
         return (1 + self.periodic_interest_rate())**self.compound_periods - 1
 
     def future_lump_value(self):
+        if self.term_structure():
+            return super(CompoundingCashFlow, self).future_lump_value()
         return self.present_value * (1 + self.periodic_interest_rate())**(self.total_compound_periods())
 
+    @staticmethod
+    def _effective_rates(rate, compound_periods):
+        return (1 + rate / compound_periods)**compound_periods - 1
+
+    @staticmethod
+    def _future_lump_values(present_value, rate, N, compound_periods):
+        return present_value * (1 + rate / compound_periods)**(N * compound_periods)
+
 
 class ContinuousCompoundingCashFlow(CashFlow):
 
+    def _compounding(self):
+        return np.inf
+
     def effective_rate(self):
+        if self.term_structure():
+            return super(ContinuousCompoundingCashFlow, self).effective_rate()
         return math.e**self.interest_rate.interest_rate() - 1
 
     def future_lump_value(self):
+        if self.term_structure():
+            return super(ContinuousCompoundingCashFlow, self).future_lump_value()
         return self.present_value * math.e**(self.interest_rate.interest_rate() * self.N)
 
+    @staticmethod
+    def _effective_rates(rate, compound_periods):
+        return np.exp(rate) - 1
+
+    @staticmethod
+    def _future_lump_values(present_value, rate, N, compound_periods):
+        return present_value * np.exp(rate * N)
+
 
 # Chapter 2 Discounted Cash Flow Operations
 
@@ -245,3 +555,107 @@ class NetPresentValue(pm.Parameterized):
         self.discount_rate = discount_rate
         self.cash_flows = cash_flows
         super(NetPresentValue, self).__init__(**params)
+
+    def npv(self):
+        """
+        The present value of the cash flows, where cash_flows[t] is received at
+        the end of period t and cash_flows[0] is the initial investment.
+        """
+        if isinstance(self.discount_rate, YieldCurve):
+            return self.batch_npv(self.cash_flows, self.discount_rate)[0]
+        return self.batch_npv(self.cash_flows, self.discount_rate.interest_rate())[0]
+
+    def irr(self):
+        """
+        The internal rate of return is the discount rate that makes the net
+        present value of the cash flows equal to zero.
+        """
+        return self.batch_irr(self.cash_flows)[0]
+
+    def npv_rule(self):
+        """Undertake the investment if its NPV is positive."""
+        return self.npv() > 0
+
+    @staticmethod
+    def _npv(cash_flows, rate):
+        """NPV and its derivative by rate for each row of cash_flows"""
+        t = np.arange(cash_flows.shape[1])
+        discounted = cash_flows * (1 + rate[:, None])**(-t)
+        npv = discounted.sum(axis=1)
+        derivative = -(discounted * t).sum(axis=1) / (1 + rate)
+        return npv, derivative
+
+    @classmethod
+    def batch_npv(cls, cash_flows, rate):
+        """
+        NPV of a matrix of cash flow streams (projects x periods). rate is a
+        number, an array with a discount rate per project, or a YieldCurve
+        whose cached discount factors value every project at once.
+        """
+        cash_flows = np.atleast_2d(np.asarray(cash_flows, dtype=float))
+        if isinstance(rate, YieldCurve):
+            return cash_flows @ rate.discount_factors(cash_flows.shape[1] - 1)
+        rate = np.broadcast_to(np.asarray(rate, dtype=float), cash_flows.shape[:1])
+        return cls._npv(cash_flows, rate)[0]
+
+    @classmethod
+    def batch_irr(cls, cash_flows, tol=1e-10, maxiter=100):
+        """
+        IRR of a matrix of cash flow streams (projects x periods), solved for
+        all projects at once. Each project keeps a bracket where its NPV
+        changes sign and takes a Newton step when it stays inside the bracket
+        and at least halves the previous step, otherwise it bisects the
+        bracket. Projects whose NPV does not change sign between -99.99% and
+        1e6 have no IRR and return nan.
+        """
+        cash_flows = np.atleast_2d(np.asarray(cash_flows, dtype=float))
+        projects = len(cash_flows)
+        lo = np.full(projects, -0.9999)
+        hi = np.full(projects, 1e6)
+        t = np.arange(cash_flows.shape[1])
+        with np.errstate(over='ignore', invalid='ignore'):
+            # zero cash flows times overflowing factors are dropped as nan
+            f_lo = np.nansum(cash_flows * (1 + lo[:, None])**(-t), axis=1)
+            f_hi = np.nansum(cash_flows * (1 + hi[:, None])**(-t), axis=1)
+        irr = np.full(projects, np.nan)
+        active = np.flatnonzero(np.sign(f_lo) != np.sign(f_hi))
+        lo, hi, sign_lo = lo[active], hi[active], np.sign(f_lo[active])
+        c = cash_flows[active]
+        rate = np.full(len(active), 0.1)
+        previous = hi - lo
+        for _ in range(maxiter):
+            if not len(active):
+                break
+            f, df = cls._npv(c, rate)
+            lower = np.sign(f) == sign_lo
+            lo = np.where(lower, rate, lo)
+            hi = np.where(lower, hi, rate)
+            close = tol * (1 + np.abs(rate))
+            done = (f == 0) | (np.abs(previous) <= close) | (hi - lo <= close)
+            irr[active[done]] = rate[done]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                newton = rate - f / df
+            # bisect in log(1 + rate) while the bracket spans large rates
+            middle = np.where(hi > 1, np.sqrt((1 + lo) * (1 + hi)) - 1, (lo + hi) / 2)
+            accept = (newton > lo) & (newton < hi) & (np.abs(newton - rate) < np.abs(previous) / 2)
+            step = np.where(accept, newton, middle)
+            previous = step - rate
+            keep = ~done
+            active, c, sign_lo = active[keep], c[keep], sign_lo[keep]
+            lo, hi, rate, previous = lo[keep], hi[keep], step[keep], previous[keep]
+        return irr
+
+    @classmethod
+    def batch_evaluate(cls, cash_flows, rate):
+        """
+        NPV, IRR and NPV rule of a matrix of cash flow streams (projects x
+        periods), with the projects ranked by NPV (1 is the best).
+        """
+        npv = cls.batch_npv(cash_flows, rate)
+        result = pd.DataFrame({
+            'npv': npv,
+            'irr': cls.batch_irr(cash_flows),
+            'undertake': npv > 0,
+        })
+        result['rank'] = result['npv'].rank(ascending=False, method='first').astype(int)
+        return result
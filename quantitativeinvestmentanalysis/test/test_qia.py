@@ -48,3 +48,116 @@ def test_present_value_annuity():
     cashflow = CashFlow(r, annuity=20000, N=19)
     assert cashflow.present_annuity_value() - 2267119.05 < 0.1
 
+
+
+from quantitativeinvestmentanalysis.qia import ContinuousCompoundingCashFlow
+def test_batch_valuation_matches_instances():
+    rates = np.array([0.02, 0.07, 0.12])
+    N = np.array([1, 19, 40])
+    perpetuity = np.array([False, False, True])
+    for cls in [CashFlow, CompoundingCashFlow, ContinuousCompoundingCashFlow]:
+        batch = cls.batch_valuation(rates, present_value=1000, annuity=20000, N=N,
+                                    perpetuity=perpetuity, compound_periods=4)
+        for i, rate in enumerate(rates):
+            params = {'present_value': 1000, 'annuity': 20000, 'N': int(N[i]), 'perpetuity': bool(perpetuity[i])}
+            if cls is CompoundingCashFlow:
+                params['compound_periods'] = 4
+            c = cls(InterestRate(real_risk_free_interest_rate=rate), **params)
+            assert np.isclose(batch['future_lump_value'][i], c.future_lump_value())
+            assert np.isclose(batch['present_annuity_value'][i], c.present_annuity_value())
+            assert np.isclose(batch['total_future_value'][i], c.total_future_value())
+            assert np.isclose(c.cash_flow()['Total Value'].iloc[-1], c.total_future_value())
+
+from quantitativeinvestmentanalysis.qia import NetPresentValue
+def test_net_present_value_batch():
+    cash_flows = [-100, 30, 40, 50, 20]
+    npv = NetPresentValue(InterestRate(real_risk_free_interest_rate=0.1), cash_flows)
+    assert np.isclose(npv.npv(), sum(c / 1.1**t for t, c in enumerate(cash_flows)))
+    assert npv.npv_rule()
+    assert np.isclose(NetPresentValue.batch_npv(cash_flows, npv.irr())[0], 0)
+
+    rng = np.random.default_rng(0)
+    projects = np.concatenate([-rng.uniform(100, 1000, (200, 1)), rng.uniform(0, 300, (200, 10))], axis=1)
+    irr = NetPresentValue.batch_irr(projects)
+    assert np.allclose(NetPresentValue.batch_npv(projects, irr), 0, atol=1e-6)
+    assert np.allclose(NetPresentValue.batch_irr([[-100, 110, 0, 0], [-100, 0, 0, 133.1]]), 0.1)
+    assert np.isnan(NetPresentValue.batch_irr([100, 100])[0])
+
+    evaluation = NetPresentValue.batch_evaluate(projects, 0.05)
+    assert (evaluation['undertake'] == (evaluation['npv'] > 0)).all()
+    assert evaluation['rank'][evaluation['npv'].idxmax()] == 1
+
+from quantitativeinvestmentanalysis.qia import YieldCurve
+def test_yield_curve_discounting():
+    flat = YieldCurve(real_risk_free_interest_rate=0.05)
+    for cls, params in [(CashFlow, {}), (CompoundingCashFlow, {'compound_periods': 12}),
+                        (ContinuousCompoundingCashFlow, {})]:
+        a = cls(InterestRate(real_risk_free_interest_rate=0.05), N=10, annuity=100, present_value=1000, **params)
+        b = cls(flat, N=10, annuity=100, present_value=1000, **params)
+        for method in ['effective_rate', 'present_value_factor', 'future_lump_value', 'future_annuity_value',
+                       'present_annuity_value', 'total_present_value']:
+            assert np.isclose(getattr(a, method)(), getattr(b, method)()), (cls, method)
+        assert np.allclose(a.cash_flow()['Annuity Value'], b.cash_flow()['Annuity Value'])
+    assert np.allclose(CashFlow(flat, N=10).cash_flow().values,
+                       CashFlow(InterestRate(real_risk_free_interest_rate=0.05), N=10).cash_flow().values)
+    assert np.isclose(CompoundingCashFlow(flat, N=10, present_value=1000, compound_periods=12).future_lump_value(),
+                      1000 * (1 + 0.05/12)**120)
+
+    curve = YieldCurve(maturities=[1, 5, 30], rates=[0.02, 0.04, 0.05])
+    assert np.allclose(curve.spot_rate([0.5, 3, 10, 40]), [0.02, 0.03, 0.042, 0.05])
+    factors = curve.discount_factors(20)
+    assert curve.discount_factors(10).base is factors.base
+    assert np.isclose(CashFlow(curve, N=7).present_value_factor(), 1.0408**-7)
+
+    cash_flows = np.random.default_rng(0).normal(size=(50, 21))
+    npv = NetPresentValue.batch_npv(cash_flows, curve)
+    assert np.isclose(npv[3], NetPresentValue(curve, list(cash_flows[3])).npv())
+    assert np.isclose(npv[3], sum(c * curve.discount_factor(t) for t, c in enumerate(cash_flows[3])))
+    curve.rates = [0.03, 0.04, 0.05]
+    assert curve.version == 1
+    assert np.isclose(curve.discount_factors(1)[1], 1 / 1.03)
+
+from quantitativeinvestmentanalysis.qia import StochasticInterestRate
+def test_stochastic_interest_rate_simulation():
+    flat = StochasticInterestRate(real_risk_free_interest_rate=0.05, volatility=0)
+    for cls in [CashFlow, CompoundingCashFlow, ContinuousCompoundingCashFlow]:
+        c = cls(flat, N=10, annuity=100, present_value=1000)
+        simulation = c.simulate(100, chunk_size=30)
+        assert len(simulation) == 100
+        assert np.allclose(simulation['future_lump_value'], c.future_lump_value())
+        assert np.allclose(simulation['future_annuity_value'], c.future_annuity_value())
+        assert np.allclose(simulation['present_annuity_value'], c.present_annuity_value())
+
+    for model in ['vasicek', 'cir']:
+        r = StochasticInterestRate(real_risk_free_interest_rate=0.03, model=model,
+                                   volatility=0.02, long_term_rate=0.05)
+        paths = r.paths(20000, 30, seed=1)
+        assert paths.shape == (20000, 31)
+        assert (paths[:, 0] == 0.03).all()
+        assert abs(paths[:, -1].mean() - 0.05) < 1e-3
+        if model == 'cir':
+            assert (paths >= 0).all()
+        r._path_block = 64
+        chunks = list(r.iter_paths(1000, 10, chunk_size=100))
+        assert [len(chunk) for chunk in chunks] == [100] * 10
+        for chunk_size in [7, 300, 5000]:
+            assert (np.concatenate(chunks) == np.concatenate(list(r.iter_paths(1000, 10, chunk_size=chunk_size)))).all()
+        c = CashFlow(r, N=10, annuity=100, present_value=1000)
+        assert c.simulate(500, chunk_size=50).equals(c.simulate(500, chunk_size=200))
+
+import os
+import subprocess
+import sys
+def test_qia_imports_without_plotting_stack():
+    code = """
+import sys, time
+import numpy, pandas, param
+start = time.perf_counter()
+import quantitativeinvestmentanalysis.qia
+elapsed = time.perf_counter() - start
+loaded = [m for m in ['panel', 'holoviews', 'hvplot', 'bokeh'] if m in sys.modules]
+assert not loaded, loaded
+assert elapsed < 0.5, elapsed
+"""
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    subprocess.run([sys.executable, '-c', code], cwd=root, check=True)